@@ -2,12 +2,52 @@ import sys
 import os
 import tomllib
 import tarfile
+import gzip
 import urllib.request
+import io
 import ssl
-from collections import deque, defaultdict
+import hashlib
+import pickle
+import tempfile
+import mmap
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 import subprocess
 
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
 CONFIG_PATH = "config.toml"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Число параллельных соединений при загрузке по диапазонам (Range)
+DOWNLOAD_WORKERS = 4
+# Параллельная загрузка по диапазонам включается для архивов от этого размера
+PARALLEL_DOWNLOAD_MIN_SIZE = 1024 * 1024
+# Буфер чтения тестового файла: меньше системных вызовов read() на больших файлах
+INDEX_READ_BUFFER_SIZE = 1024 * 1024
+
+# SSL-контекст и opener создаются один раз и общие для всех запросов
+# (обычная загрузка и диапазоны), а не заново на каждый вызов.
+# Сертификаты проверяются; набор корневых сертификатов берётся из certifi,
+# если он установлен (актуально для macOS/Windows), иначе — системный.
+_SSL_CONTEXT = ssl.create_default_context(cafile=certifi.where() if certifi else None)
+_OPENER = urllib.request.build_opener(urllib.request.HTTPSHandler(context=_SSL_CONTEXT))
+
+# Разобранные индексы: (index_path, test_mode) → (forward, reverse)
+_INDEX_CACHE = {}
+# Каталог дискового кэша разобранных индексов между запусками — в кэше
+# пользователя, а не в текущем каталоге
+INDEX_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME")
+    or os.environ.get("LOCALAPPDATA")
+    or os.path.join(os.path.expanduser("~"), ".cache"),
+    "graphMaker",
+)
+# Версия формата кэша: меняется при изменении структуры сохраняемых данных
+INDEX_CACHE_FORMAT = 3
 
 
 def load_config(path):
@@ -46,18 +86,146 @@ def validate_config(cfg):
 
 
 
+class _ChunkReader:
+    """Файлоподобное чтение из очереди кусков; b"" в очереди означает конец потока"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buf = b""
+        self._pos = 0
+        self._eof = False
+
+    def _next_chunk(self):
+        self._buf, self._pos = self._chunks.get(), 0
+        self._eof = not self._buf
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        parts = []
+        while size != 0:
+            if self._pos >= len(self._buf):
+                if self._eof:
+                    break
+                self._next_chunk()
+                continue
+            end = len(self._buf) if size < 0 else self._pos + size
+            part = self._buf[self._pos:end]
+            self._pos += len(part)
+            parts.append(part)
+            if size > 0:
+                size -= len(part)
+        return b"".join(parts)
+
+
+def _extract_apk_index(fileobj):
+    """Потоковое извлечение APKINDEX из APKINDEX.tar.gz"""
+    # Архив состоит из нескольких gzip-потоков (подпись + индекс),
+    # а "r|gz" читает только первый из них, поэтому распаковку делает GzipFile.
+    with gzip.GzipFile(fileobj=fileobj) as gz, tarfile.open(fileobj=gz, mode="r|", bufsize=DOWNLOAD_CHUNK_SIZE) as tar:
+        for member in tar:
+            if member.name == "APKINDEX":
+                return tar.extractfile(member).read()
+    raise FileNotFoundError("APKINDEX не найден в архиве")
+
+
+class _RangeNotSupported(Exception):
+    """Сервер ответил на запрос диапазона не кодом 206 или не тем диапазоном"""
+
+
+def _read_range(response, buf, start, end):
+    """Чтение байтов [start, end] из ответа прямо в общий буфер"""
+    with memoryview(buf) as view:
+        pos = start
+        while pos <= end:
+            n = response.readinto(view[pos:end + 1])
+            if not n:
+                raise ConnectionError(f"Неполный ответ сервера для диапазона {start}-{end}")
+            pos += n
+
+
+def _fetch_range(repo_path, validator, buf, start, end):
+    """Загрузка байтов [start, end] архива; If-Range не даст склеить части разных версий"""
+    request = urllib.request.Request(repo_path, headers={"Range": f"bytes={start}-{end}", "If-Range": validator})
+    with _OPENER.open(request) as response:
+        content_range = response.headers.get("Content-Range", "")
+        if response.status != 206 or not content_range.startswith(f"bytes {start}-{end}/"):
+            raise _RangeNotSupported()
+        _read_range(response, buf, start, end)
+
+
+def _range_validator(response):
+    """ETag или Last-Modified для If-Range, если ответ можно догружать по диапазонам"""
+    if response.status != 200 or response.headers.get("Accept-Ranges") != "bytes":
+        return None
+    etag = response.headers.get("ETag")
+    # Слабый ETag (W/...) в If-Range не допускается
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _download_ranged(repo_path, response, size, validator):
+    """Параллельная загрузка архива по диапазонам; None при любой ошибке.
+
+    Первая часть читается из уже открытого ответа на обычный GET,
+    остальные догружаются параллельными запросами с If-Range.
+    """
+    buf = bytearray(size)
+    step = -(-size // DOWNLOAD_WORKERS)
+    try:
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS - 1) as executor:
+            futures = [
+                executor.submit(_fetch_range, repo_path, validator, buf, start, min(start + step, size) - 1)
+                for start in range(step, size, step)
+            ]
+            _read_range(response, buf, 0, step - 1)
+            for future in futures:
+                future.result()
+    except Exception:
+        return None
+    return buf
+
+
+def _stream_apk_index(response):
+    """Извлечение APKINDEX из ответа одним потоком"""
+    # Загрузка и распаковка идут параллельно: основной поток читает ответ
+    # кусками в очередь, фоновый распаковывает архив по мере поступления.
+    chunks = Queue()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(_extract_apk_index, _ChunkReader(chunks))
+        try:
+            while not future.done():
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.put(chunk)
+        finally:
+            chunks.put(b"")
+        return future.result()
+
+
 def download_apk_index(repo_path, repo_mode):
-    """Загрузка APKINDEX с SSL-обходом для macOS/Windows"""
+    """Загрузка APKINDEX с проверкой SSL-сертификатов"""
     if repo_mode == "remote":
         print(f"Загрузка APKINDEX из {repo_path} ...")
-        ctx = ssl._create_unverified_context()
-
-        with urllib.request.urlopen(repo_path, context=ctx) as response, open("APKINDEX.tar.gz", "wb") as out_file:
-            out_file.write(response.read())
-
-        with tarfile.open("APKINDEX.tar.gz", "r:gz") as tar:
-            tar.extract("APKINDEX")
-        return "APKINDEX"
+        # Сначала обычный GET: на диапазоны архив делится, только если
+        # сервер их поддерживает, а размер не меньше PARALLEL_DOWNLOAD_MIN_SIZE
+        with _OPENER.open(repo_path) as response:
+            validator = _range_validator(response)
+            size = int(response.headers.get("Content-Length") or 0)
+            if validator is None or size < PARALLEL_DOWNLOAD_MIN_SIZE:
+                return _stream_apk_index(response)
+            data = _download_ranged(repo_path, response, size, validator)
+
+        if data is not None:
+            try:
+                return _extract_apk_index(io.BytesIO(data))
+            except Exception:
+                pass  # части не сошлись (например, архив обновился) — загрузка заново
+        # Любая ошибка параллельной загрузки — повтор одним потоком
+        with _OPENER.open(repo_path) as response:
+            return _stream_apk_index(response)
 
     elif repo_mode == "local":
         local = os.path.join(repo_path, "APKINDEX")
@@ -69,83 +237,206 @@ def download_apk_index(repo_path, repo_mode):
         return repo_path  # путь к тестовому файлу
 
 
-def parse_apk_index(index_path, package_name, test_mode=False):
-    """Чтение APKINDEX или тестового файла"""
-    if test_mode:
-        dep_map = {}
-        with open(index_path, "r") as f:
-            for line in f:
-                if ":" not in line:
-                    continue
-                pkg, deps = line.strip().split(":")
-                pkg = pkg.strip()
-                deps = deps.strip().split() if deps.strip() else []
-                dep_map[pkg] = deps
-        return dep_map.get(package_name, [])
-
-    deps = []
-    current = None
-    with open(index_path, "r", encoding="utf-8", errors="ignore") as f:
+def load_test_repo_graph(path):
+    """Чтение тестового файла вида 'A: B C' в словарь пакет → deps"""
+    graph = {}
+    intern = sys.intern
+    with open(path, "rb", buffering=INDEX_READ_BUFFER_SIZE) as f:
         for line in f:
-            line = line.strip()
-            if line.startswith("P:"):
-                current = line[2:]
-            elif line.startswith("D:") and current == package_name:
-                deps = [d for d in line[2:].split(" ") if d]
-                break
-    return deps
+            pkg, sep, deps = line.partition(b":")
+            if not sep:
+                continue
+            pkg = intern(pkg.strip().decode("utf-8", "ignore"))
+            graph[pkg] = tuple([intern(d.decode("utf-8", "ignore")) for d in deps.split()])
+    return graph
 
 
+def build_forward_graph(index_path, test_mode=False):
+    """Однократный разбор APKINDEX (путь или содержимое в bytes).
 
-def get_all_dependencies_bfs(root_pkg, index_path, max_depth, filter_substring, test_mode):
-    graph = defaultdict(list)
-    visited = set()
-    queue = deque([(root_pkg, 0)])
+    Возвращает (forward, reverse): пакет → deps и пакет → зависящие от него пакеты.
+    """
+    if test_mode:
+        return _build_dep_maps(load_test_repo_graph(index_path).items())
+
+    if isinstance(index_path, bytes):
+        return _build_dep_maps(iter_apkindex(index_path))
+
+    # Файл отображается в память и сканируется без построчного чтения
+    # и без декодирования ненужных полей
+    with open(index_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}, {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return _build_dep_maps(iter_apkindex(buf))
+
+
+def iter_apkindex(buf):
+    """Генератор пар (пакет, deps) по записям APKINDEX из буфера"""
+    # Записи ищутся через find по "\nP:" и "\nD:": цикл идёт по записям,
+    # а не по строкам, и декодируются только имя пакета и поле D:
+    intern = sys.intern
+    find = buf.find
+    size = len(buf)
+
+    if buf[:2] == b"P:":
+        pos = 0
+    else:
+        pos = find(b"\nP:")
+        pos = pos + 1 if pos >= 0 else -1
+
+    while pos >= 0:
+        name_end = find(b"\n", pos)
+        if name_end < 0:
+            name_end = size
+        next_record = find(b"\nP:", name_end)
+        end = next_record if next_record >= 0 else size
+
+        dep = find(b"\nD:", name_end, end)
+        if dep >= 0:
+            dep_end = find(b"\n", dep + 3, end + 1)
+            if dep_end < 0:
+                dep_end = end
+            pkg = intern(buf[pos + 2:name_end].strip().decode("utf-8", "ignore"))
+            yield pkg, tuple([intern(d) for d in buf[dep + 3:dep_end].decode("utf-8", "ignore").split()])
+
+        pos = next_record + 1 if next_record >= 0 else -1
+
+
+def _build_dep_maps(records):
+    """(forward, reverse) за один проход по парам (пакет, deps); значения — кортежи"""
+    forward = {}
+    reverse = {}
+    for pkg, deps in records:
+        forward[pkg] = deps
+        for d in deps:
+            reverse.setdefault(d, []).append(pkg)
+    # Обратный граф заполняется добавлением, поэтому в кортежи переводится в конце
+    return forward, {d: tuple(pkgs) for d, pkgs in reverse.items()}
 
-    while queue:
-        pkg, depth = queue.popleft()
 
-        if depth > max_depth:
-            continue
+class _IndexUnpickler(pickle.Unpickler):
+    """Unpickler без загрузки глобальных имён: в кэше только dict, tuple и str"""
 
-        if pkg in visited:
-            continue
-        visited.add(pkg)
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Недопустимый объект в кэше: {module}.{name}")
 
-        if filter_substring and filter_substring in pkg:
-            continue
 
-        deps = parse_apk_index(index_path, pkg, test_mode=test_mode)
+def _index_cache_entry(index_path, test_mode):
+    """Файл дискового кэша и штамп источника.
+
+    Имя файла зависит только от источника (путь или "remote" для bytes), поэтому
+    на каждый источник хранится одна запись; размер/mtime или хэш содержимого
+    сохраняются внутри файла и сверяются при чтении.
+    """
+    if isinstance(index_path, bytes):
+        source = "remote"
+        stamp = hashlib.blake2b(index_path).hexdigest()
+    else:
+        st = os.stat(index_path)
+        source = os.path.abspath(index_path)
+        stamp = (st.st_size, st.st_mtime_ns)
+    key = hashlib.blake2b(f"{source}|{test_mode}".encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(INDEX_CACHE_DIR, key + ".pickle"), (INDEX_CACHE_FORMAT, stamp)
+
+
+def _load_index_tables(index_path, test_mode):
+    """Чтение (forward, reverse) из дискового кэша или разбор индекса с записью в кэш"""
+    cache_file, stamp = _index_cache_entry(index_path, test_mode)
+    try:
+        with open(cache_file, "rb") as f:
+            cached_stamp, tables = _IndexUnpickler(f).load()
+        if (cached_stamp == stamp and isinstance(tables, tuple) and len(tables) == 2
+                and isinstance(tables[0], dict) and isinstance(tables[1], dict)):
+            return tables
+    except Exception:
+        pass  # кэша нет, он устарел или повреждён — индекс разбирается заново
+
+    tables = build_forward_graph(index_path, test_mode)
+    # Кэш только ускоряет повторный запуск, ошибка записи не критична
+    try:
+        os.makedirs(INDEX_CACHE_DIR, mode=0o700, exist_ok=True)
+        # Уникальный временный файл: параллельные запуски не пишут в один и тот же
+        fd, tmp_file = tempfile.mkstemp(dir=INDEX_CACHE_DIR, prefix=os.path.basename(cache_file) + ".", suffix=".tmp")
+    except OSError:
+        return tables
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((stamp, tables), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        try:
+            os.unlink(tmp_file)  # недописанный файл не остаётся в каталоге кэша
+        except OSError:
+            pass
+    return tables
+
+
+def get_index_table(index_path, test_mode=False):
+    """(forward, reverse) для индекса; файл разбирается только при первом обращении"""
+    key = (index_path, test_mode)
+    if key not in _INDEX_CACHE:
+        _INDEX_CACHE[key] = _load_index_tables(index_path, test_mode)
+    return _INDEX_CACHE[key]
+
+
+def parse_apk_index(index_path, package_name, test_mode=False):
+    """Чтение APKINDEX или тестового файла"""
+    return get_index_table(index_path, test_mode)[0].get(package_name, ())
+
+
+
+def get_all_dependencies_bfs(root_pkg, dep_map, max_depth, filter_substring):
+    graph = {}
+    if max_depth < 0 or (filter_substring and filter_substring in root_pkg):
+        return graph
+
+    # Для глубины 0 и 1 очередь не нужна: корень и его прямые зависимости
+    if max_depth <= 1:
+        graph[root_pkg] = root_deps = dep_map.get(root_pkg, ())
+        if max_depth == 1:
+            for d in root_deps:
+                if d not in graph and not (filter_substring and filter_substring in d):
+                    graph[d] = dep_map.get(d, ())
+        return graph
+
+    # Глубина и фильтр проверяются при постановке в очередь, поэтому всё,
+    # что попало в очередь, уже находится в пределах max_depth и не отфильтровано
+    enqueued = {root_pkg}
+    queue = deque([(root_pkg, 0)])
+    # Методы, вызываемые на каждой итерации, связываются с локальными именами
+    _get = dep_map.get
+    popleft = queue.popleft
+    append = queue.append
+    enqueued_add = enqueued.add
+
+    while queue:
+        pkg, depth = popleft()
+        deps = _get(pkg, ())
         graph[pkg] = deps
 
         if depth < max_depth:
             for d in deps:
-                if d not in visited:
-                    queue.append((d, depth + 1))
+                if d not in enqueued:
+                    enqueued_add(d)
+                    if not (filter_substring and filter_substring in d):
+                        append((d, depth + 1))
 
     return graph
 
 
 
-def get_reverse_dependencies(graph):
-    reverse_graph = defaultdict(list)
-    for pkg, deps in graph.items():
-        for d in deps:
-            reverse_graph[d].append(pkg)
-    return reverse_graph
-
-
 def print_reverse_deps(reverse_graph, target):
     print(f"\nОбратные зависимости для '{target}':")
     if target not in reverse_graph or not reverse_graph[target]:
         print("  Нет пакетов, которые зависят от этого.")
         return
-    for pkg in reverse_graph[target]:
-        print(f"  - {pkg}")
+    sys.stdout.write("".join(f"  - {pkg}\n" for pkg in reverse_graph[target]))
 
 
 
 def generate_dot(graph):
+    """DOT-описание графа в виде bytes (UTF-8), готовых для передачи в dot"""
     lines = ["digraph G {"]
     for pkg, deps in graph.items():
         for dep in deps:
@@ -153,17 +444,15 @@ def generate_dot(graph):
         if not deps:
             lines.append(f'    "{pkg}";')
     lines.append("}")
-    return "\n".join(lines)
+    return "\n".join(lines).encode("utf-8")
 
 
-def save_graph_svg(dot_str, output_file):
+def save_graph_svg(dot_bytes, output_file):
     try:
         svg_file = output_file if output_file.endswith(".svg") else output_file + ".svg"
-        process = subprocess.run(
-            ["dot", "-Tsvg", "-o", svg_file],
-            input=dot_str.encode("utf-8"),
-            check=True
-        )
+        # DOT уже собран целиком, поэтому передаётся в stdin одной записью;
+        # run сам обрабатывает ранний выход dot (EPIPE, а на Windows EINVAL)
+        subprocess.run(["dot", "-Tsvg", "-o", svg_file], input=dot_bytes, check=True)
         print(f"Граф сохранен в {svg_file}")
     except FileNotFoundError:
         print("Ошибка: Graphviz не установлен или не найден 'dot'")
@@ -171,17 +460,39 @@ def save_graph_svg(dot_str, output_file):
         print("Ошибка при генерации SVG:", e)
 
 
-def print_ascii_tree(graph, root, prefix=""):
-    print(prefix + root)
-    deps = graph.get(root, [])
-    for i, dep in enumerate(deps):
-        if i == len(deps) - 1:
-            connector = "└─ "
-            next_prefix = prefix + "   "
+def format_ascii_tree(graph, root, prefix=""):
+    """Текст дерева зависимостей; уже показанные пакеты повторно не раскрываются"""
+    lines = []
+    seen = set()
+    # Явный стек вместо рекурсии: (пакет, префикс, последний ли среди соседей);
+    # None у корня означает строку без соединителя
+    stack = [(root, prefix, None)]
+    while stack:
+        pkg, node_prefix, is_last = stack.pop()
+        if is_last is None:
+            line = node_prefix + pkg
+            child_prefix = node_prefix
         else:
-            connector = "├─ "
-            next_prefix = prefix + "│  "
-        print_ascii_tree(graph, dep, prefix=next_prefix + connector)
+            line = node_prefix + ("└─ " if is_last else "├─ ") + pkg
+            child_prefix = node_prefix + ("   " if is_last else "│  ")
+
+        deps = graph.get(pkg, ())
+        if pkg in seen:
+            # Поддерево уже выведено выше (общая зависимость или цикл)
+            lines.append(line + " (уже показан)" if deps else line)
+            continue
+        seen.add(pkg)
+        lines.append(line)
+
+        last = len(deps) - 1
+        for i in range(last, -1, -1):
+            stack.append((deps[i], child_prefix, i == last))
+
+    return "\n".join(lines) + "\n"
+
+
+def print_ascii_tree(graph, root, prefix=""):
+    sys.stdout.write(format_ascii_tree(graph, root, prefix))
 
 
 
@@ -200,37 +511,47 @@ def main():
         print("Получение APKINDEX...")
         index_path = download_apk_index(config["repo_path"], config["repo_mode"])
 
+        # Индекс разбирается один раз, дальше все запросы идут к словарю
+        dep_map, reverse_map = get_index_table(index_path, test_mode)
+
         # Этап 2: прямые зависимости
         print(f"\nПрямые зависимости '{config['package_name']}':")
-        direct = parse_apk_index(index_path, config["package_name"], test_mode)
-        for d in direct:
-            print(f"  - {d}")
+        direct = dep_map.get(config["package_name"], ())
+        sys.stdout.write("".join(f"  - {d}\n" for d in direct))
 
         # Этап 3: граф BFS
         print("\nПостроение графа зависимостей (BFS)...")
         graph = get_all_dependencies_bfs(
             config["package_name"],
-            index_path,
+            dep_map,
             config["max_depth"],
-            config["filter_substring"],
-            test_mode
+            config["filter_substring"]
         )
 
+        # Граф выводится одной записью вместо print на каждый пакет
         print("\nГраф зависимостей (пакет → deps):")
-        for pkg, deps in graph.items():
-            print(f"{pkg}: {deps}")
+        sys.stdout.write("".join(
+            f"{pkg}: {', '.join(deps) if deps else '(нет зависимостей)'}\n"
+            for pkg, deps in graph.items()
+        ))
 
         # Этап 4: обратные зависимости
-        rev = get_reverse_dependencies(graph)
-        print_reverse_deps(rev, config["package_name"])
+        print_reverse_deps(reverse_map, config["package_name"])
 
         # Этап 5: визуализация
-        dot_str = generate_dot(graph)
-        save_graph_svg(dot_str, config["output_file"])
-
-        if config["ascii_mode"]:
+        # Graphviz работает в фоновом потоке, пока строится ASCII-дерево;
+        # дерево выводится после SVG, чтобы сообщения не перемешивались
+        dot_bytes = generate_dot(graph)
+        tree = None
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            svg_future = executor.submit(save_graph_svg, dot_bytes, config["output_file"])
+            if config["ascii_mode"]:
+                tree = format_ascii_tree(graph, config["package_name"])
+            svg_future.result()
+
+        if tree is not None:
             print("\nASCII-дерево зависимостей:")
-            print_ascii_tree(graph, config["package_name"])
+            sys.stdout.write(tree)
 
     except Exception as e:
         print(f"Ошибка: {e}")